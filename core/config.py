@@ -1,14 +1,26 @@
 import os
-from typing import Optional
+from typing import Any, Optional
 from pydantic_settings import BaseSettings
-from pydantic import Field
+from pydantic import Field, create_model
 
 
-class Settings(BaseSettings):
+class BaseAppSettings(BaseSettings):
+    """Общая конфигурация источников настроек"""
+    
+    class Config:
+        env_file = ".env"
+        env_file_encoding = "utf-8"
+
+
+class Settings(BaseAppSettings):
     """Настройки приложения из переменных окружения"""
     
     # База данных
     database_url: str = Field(..., env="DATABASE_URL")
+    db_pool_size: int = Field(default=20, env="DB_POOL_SIZE")
+    db_max_overflow: int = Field(default=40, env="DB_MAX_OVERFLOW")
+    db_pool_recycle: int = Field(default=1800, env="DB_POOL_RECYCLE")  # секунды
+    db_statement_cache_size: int = Field(default=2048, env="DB_STATEMENT_CACHE_SIZE")
     
     # API настройки
     api_host: str = Field(default="0.0.0.0", env="API_HOST")
@@ -26,10 +38,33 @@ class Settings(BaseSettings):
     timezone: str = Field(default="Europe/Moscow", env="TIMEZONE")
     rate_limit: int = Field(default=30, env="RATE_LIMIT")
     
-    class Config:
-        env_file = ".env"
-        env_file_encoding = "utf-8"
+    # Тесты: соединения не переиспользуются между тестами/процессами (NullPool)
+    testing: bool = Field(default=False, env="TESTING")
+
+
+class LazySettings:
+    """Ленивые настройки: каждое поле читается и валидируется при первом обращении
+    
+    Позволяет использовать часть настроек (например, только DATABASE_URL
+    в миграциях), не требуя наличия остальных обязательных переменных.
+    """
+    
+    def __getattr__(self, name: str) -> Any:
+        field = Settings.model_fields.get(name)
+        if field is None:
+            raise AttributeError(name)
+        
+        # Модель из одного поля: валидируется только запрошенное значение
+        model = create_model(
+            f"Settings_{name}",
+            __base__=BaseAppSettings,
+            **{name: (field.annotation, field)}
+        )
+        value = getattr(model(), name)
+        # Кэшируем в __dict__, чтобы следующие обращения не доходили до __getattr__
+        self.__dict__[name] = value
+        return value
 
 
 # Глобальный экземпляр настроек
-settings = Settings()
+settings = LazySettings()
@@ -1,25 +1,100 @@
-import json
-from typing import Optional, List, Dict, Any
+import orjson
+import time
+from typing import Optional, List, Dict, Any, Tuple, Callable, Set
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update, delete
+from sqlalchemy import select, update, delete, bindparam, event
 from sqlalchemy.dialects.postgresql import insert
 
 from db.models import Config, DEFAULT_CONFIG
+from db.session import AppSession
+
+# Запрос горячего пути строится один раз при импорте
+_GET_CONFIG_STMT = select(Config.value).where(Config.key == bindparam("key"))
+
+# Ключ session.info с настройками, кэш которых сбрасывается после commit
+_PENDING_INVALIDATION = "config_cache_pending"
+# Сбросить весь кэш
+_ALL_KEYS = "*"
 
 
 class ConfigService:
     """Сервис для работы с настройками"""
     
+    # Время жизни закэшированного значения (секунды)
+    CACHE_TTL = 30.0
+    
+    # Общий для всех экземпляров кэш: ключ кэша -> (время загрузки, значение)
+    _cache: Dict[str, Tuple[float, Any]] = {}
+    
     def __init__(self, db: AsyncSession):
         self.db = db
     
+    async def _get_cached(self, key: str,
+                          parse: Optional[Callable[[Any], Any]] = None) -> Any:
+        """Получить значение настройки с кэшированием на CACHE_TTL
+        
+        Если передан parse, в кэш попадает уже разобранное значение.
+        """
+        cache_key = f"{key}:parsed" if parse is not None else key
+        pending = self.db.info.get(_PENDING_INVALIDATION, ())
+        # Незакоммиченные изменения этой сессии не должны попасть в общий кэш
+        uncommitted = key in pending or _ALL_KEYS in pending
+        
+        cached = self._cache.get(cache_key)
+        if (not uncommitted and cached is not None
+                and time.monotonic() - cached[0] < self.CACHE_TTL):
+            return cached[1]
+        
+        result = await self.db.execute(_GET_CONFIG_STMT, {"key": key})
+        value = result.scalar_one_or_none()
+        if parse is not None:
+            value = parse(value)
+        if not uncommitted:
+            self._cache[cache_key] = (time.monotonic(), value)
+        return value
+    
+    def _invalidate(self, key: str) -> None:
+        """Сбросить кэш для ключа после commit транзакции сессии"""
+        self.db.info.setdefault(_PENDING_INVALIDATION, set()).add(key)
+    
+    @classmethod
+    def _drop_cached(cls, keys: Set[str]) -> None:
+        """Удалить ключи из кэша (в том числе разобранные значения)"""
+        if _ALL_KEYS in keys:
+            cls._cache.clear()
+            return
+        for key in keys:
+            cls._cache.pop(key, None)
+            cls._cache.pop(f"{key}:parsed", None)
+    
+    @staticmethod
+    def _parse_channels(channels_json: Optional[str]) -> List[int]:
+        """Разобрать JSON список каналов, некорректные значения игнорируются"""
+        if not channels_json:
+            return []
+        try:
+            channels = orjson.loads(channels_json)
+        except orjson.JSONDecodeError:
+            return []
+        if not isinstance(channels, list):
+            return []
+        
+        result = []
+        for ch in channels:
+            # bool - подкласс int, но ID канала не является
+            if isinstance(ch, int) and not isinstance(ch, bool):
+                result.append(ch)
+            elif isinstance(ch, str) and ch.lstrip('-').isdigit():
+                # isdigit пропускает "--5" и не-ASCII цифры, int() на них падает
+                try:
+                    result.append(int(ch))
+                except ValueError:
+                    continue
+        return result
+    
     async def get_config(self, key: str) -> Optional[str]:
         """Получить значение конфигурации по ключу"""
-        result = await self.db.execute(
-            select(Config.value).where(Config.key == key)
-        )
-        config = result.scalar_one_or_none()
-        return config
+        return await self._get_cached(key)
     
     async def set_config(self, key: str, value: str, description: str = None) -> None:
         """Установить значение конфигурации"""
@@ -33,7 +108,7 @@ class ConfigService:
             set_=dict(value=stmt.excluded.value, description=stmt.excluded.description)
         )
         await self.db.execute(stmt)
-        await self.db.commit()
+        self._invalidate(key)
     
     async def get_all_config(self) -> Dict[str, Dict[str, str]]:
         """Получить все настройки"""
@@ -55,9 +130,16 @@ class ConfigService:
         result = await self.db.execute(
             delete(Config).where(Config.key == key)
         )
-        await self.db.commit()
+        self._invalidate(key)
         return result.rowcount > 0
     
+    async def preload_cache(self) -> None:
+        """Загрузить все настройки в кэш одним запросом"""
+        result = await self.db.execute(select(Config.key, Config.value))
+        loaded_at = time.monotonic()
+        for key, value in result.all():
+            self._cache[key] = (loaded_at, value)
+    
     # Специфичные методы для важных настроек
     
     async def get_bot_token(self) -> Optional[str]:
@@ -70,18 +152,18 @@ class ConfigService:
     
     async def get_required_channels(self) -> List[int]:
         """Получить список обязательных каналов"""
-        channels_json = await self.get_config("required_channels")
-        if not channels_json:
-            return []
-        try:
-            channels = json.loads(channels_json)
-            return [int(ch) for ch in channels if str(ch).lstrip('-').isdigit()]
-        except (json.JSONDecodeError, ValueError):
-            return []
+        # Разбор выполняется один раз на CACHE_TTL, в кэше хранится готовый список
+        channels = await self._get_cached(
+            "required_channels",
+            parse=self._parse_channels
+        )
+        # Копия, чтобы вызывающий код не мог изменить закэшированный список
+        return list(channels)
     
     async def set_required_channels(self, channels: List[int]) -> None:
         """Установить список обязательных каналов"""
-        channels_json = json.dumps(channels)
+        # Валидация при записи: в БД попадает только список целых ID
+        channels_json = orjson.dumps([int(ch) for ch in channels]).decode()
         await self.set_config(
             "required_channels", 
             channels_json, 
@@ -154,7 +236,30 @@ class ConfigService:
     
     async def init_default_config(self) -> None:
         """Инициализировать дефолтные настройки"""
-        for key, config in DEFAULT_CONFIG.items():
-            existing = await self.get_config(key)
-            if existing is None:
-                await self.set_config(key, config["value"], config["description"])
+        # Один INSERT ... ON CONFLICT DO NOTHING вместо SELECT + INSERT на каждый ключ
+        stmt = insert(Config).values([
+            {
+                "key": key,
+                "value": config["value"],
+                "description": config["description"]
+            }
+            for key, config in DEFAULT_CONFIG.items()
+        ])
+        stmt = stmt.on_conflict_do_nothing(index_elements=['key'])
+        await self.db.execute(stmt)
+        # Отсутствовавшие ранее ключи могли попасть в кэш как None
+        self._invalidate(_ALL_KEYS)
+
+
+@event.listens_for(AppSession, "after_commit")
+def _invalidate_after_commit(session: AppSession) -> None:
+    """Сбросить кэш настроек, измененных в закоммиченной транзакции"""
+    keys = session.info.pop(_PENDING_INVALIDATION, None)
+    if keys:
+        ConfigService._drop_cached(keys)
+
+
+@event.listens_for(AppSession, "after_rollback")
+def _discard_after_rollback(session: AppSession) -> None:
+    """Изменения откачены: закэшированные значения остаются актуальными"""
+    session.info.pop(_PENDING_INVALIDATION, None)
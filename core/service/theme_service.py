@@ -1,12 +1,20 @@
 from typing import Optional, List, Dict, Any
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update, delete, func
+from sqlalchemy import select, update, delete, func, bindparam
 from sqlalchemy.dialects.postgresql import insert
 import json
 from datetime import datetime, date
 
 from db.models import Theme
 
+_GET_THEME_BY_ID_STMT = select(Theme).where(Theme.id == bindparam("theme_id"))
+
+# Колонки темы для INSERT ... RETURNING: ORM insert возвращает и вычисляемый
+# search_vector, хотя при загрузке он отложен (deferred)
+_THEME_RETURNING_COLUMNS = [
+    column for column in Theme.__table__.c if column.key != "search_vector"
+]
+
 
 class ThemeService:
     """Сервис для работы с темами рассылок"""
@@ -19,23 +27,25 @@ class ThemeService:
                           buttons: Optional[List[Dict[str, Any]]] = None,
                           schedule_date: Optional[datetime] = None) -> Theme:
         """Создать новую тему"""
-        theme = Theme(
-            title=title,
-            text=text,
-            media=media,
-            buttons=buttons,
-            schedule_date=schedule_date
+        result = await self.db.execute(
+            select(Theme).from_statement(
+                insert(Theme)
+                .values(
+                    title=title,
+                    text=text,
+                    media=media,
+                    buttons=buttons,
+                    schedule_date=schedule_date
+                )
+                .returning(*_THEME_RETURNING_COLUMNS)
+            )
         )
-        self.db.add(theme)
-        await self.db.commit()
-        await self.db.refresh(theme)
+        theme = result.scalar_one()
         return theme
     
     async def get_theme_by_id(self, theme_id: int) -> Optional[Theme]:
         """Получить тему по ID"""
-        result = await self.db.execute(
-            select(Theme).where(Theme.id == theme_id)
-        )
+        result = await self.db.execute(_GET_THEME_BY_ID_STMT, {"theme_id": theme_id})
         return result.scalar_one_or_none()
     
     async def get_all_themes(self, offset: int = 0, limit: int = 100,
@@ -70,20 +80,16 @@ class ThemeService:
             update(Theme)
             .where(Theme.id == theme_id)
             .values(**kwargs)
+            .returning(Theme)
+            .execution_options(populate_existing=True)
         )
-        
-        if result.rowcount == 0:
-            return None
-        
-        await self.db.commit()
-        return await self.get_theme_by_id(theme_id)
+        return result.scalar_one_or_none()
     
     async def delete_theme(self, theme_id: int) -> bool:
         """Удалить тему"""
         result = await self.db.execute(
             delete(Theme).where(Theme.id == theme_id)
         )
-        await self.db.commit()
         return result.rowcount > 0
     
     async def mark_as_sent(self, theme_id: int) -> bool:
@@ -93,7 +99,6 @@ class ThemeService:
             .where(Theme.id == theme_id)
             .values(is_sent=True, updated_at=datetime.now())
         )
-        await self.db.commit()
         return result.rowcount > 0
     
     async def get_next_queue_theme(self, exclude_ids: List[int] = None) -> Optional[Theme]:
@@ -142,7 +147,6 @@ class ThemeService:
             .where(Theme.id == theme_id)
             .values(schedule_date=schedule_date, updated_at=datetime.now())
         )
-        await self.db.commit()
         return result.rowcount > 0
     
     async def unschedule_theme(self, theme_id: int) -> bool:
@@ -152,7 +156,6 @@ class ThemeService:
             .where(Theme.id == theme_id)
             .values(schedule_date=None, updated_at=datetime.now())
         )
-        await self.db.commit()
         return result.rowcount > 0
     
     async def get_themes_by_status(self, is_sent: bool = False, 
@@ -174,45 +177,36 @@ class ThemeService:
     async def search_themes(self, search_query: str, 
                            offset: int = 0, limit: int = 50) -> List[Theme]:
         """Поиск тем по заголовку или тексту"""
-        search_pattern = f"%{search_query}%"
-        
+        # search_vector @@ plainto_tsquery('russian', ...) по GIN индексу
         result = await self.db.execute(
             select(Theme).where(
-                (Theme.title.ilike(search_pattern)) |
-                (Theme.text.ilike(search_pattern))
+                Theme.search_vector.match(search_query, postgresql_regconfig="russian")
             ).offset(offset).limit(limit).order_by(Theme.created_at.desc())
         )
         return result.scalars().all()
     
     async def get_themes_statistics(self) -> Dict[str, int]:
         """Получить статистику по темам"""
-        # Общее количество тем
-        total_result = await self.db.execute(select(func.count(Theme.id)))
-        total = total_result.scalar()
-        
-        # Отправленные темы
-        sent_result = await self.db.execute(
-            select(func.count(Theme.id)).where(Theme.is_sent == True)
-        )
-        sent = sent_result.scalar()
-        
-        # Запланированные темы
-        scheduled_result = await self.db.execute(
-            select(func.count(Theme.id)).where(
-                Theme.schedule_date.is_not(None),
-                Theme.is_sent == False
-            )
-        )
-        scheduled = scheduled_result.scalar()
-        
-        # Темы в очереди
-        queue_result = await self.db.execute(
-            select(func.count(Theme.id)).where(
-                Theme.schedule_date.is_(None),
-                Theme.is_sent == False
+        # Все счетчики считаются за один проход по таблице (COUNT ... FILTER)
+        result = await self.db.execute(
+            select(
+                func.count(Theme.id).label("total"),
+                func.count(Theme.id).filter(Theme.is_sent == True).label("sent"),
+                func.count(Theme.id).filter(
+                    Theme.schedule_date.is_not(None),
+                    Theme.is_sent == False
+                ).label("scheduled"),
+                func.count(Theme.id).filter(
+                    Theme.schedule_date.is_(None),
+                    Theme.is_sent == False
+                ).label("queue")
             )
         )
-        queue = queue_result.scalar()
+        counts = result.one()
+        total = counts.total
+        sent = counts.sent
+        scheduled = counts.scheduled
+        queue = counts.queue
         
         return {
             "total": total,
@@ -230,16 +224,19 @@ class ThemeService:
         
         title = new_title or f"{original.title} (копия)"
         
-        duplicate = Theme(
-            title=title,
-            text=original.text,
-            media=original.media,
-            buttons=original.buttons,
-            schedule_date=None,  # Копия всегда идет в очередь
-            is_sent=False
+        result = await self.db.execute(
+            select(Theme).from_statement(
+                insert(Theme)
+                .values(
+                    title=title,
+                    text=original.text,
+                    media=original.media,
+                    buttons=original.buttons,
+                    schedule_date=None,  # Копия всегда идет в очередь
+                    is_sent=False
+                )
+                .returning(*_THEME_RETURNING_COLUMNS)
+            )
         )
-        
-        self.db.add(duplicate)
-        await self.db.commit()
-        await self.db.refresh(duplicate)
+        duplicate = result.scalar_one()
         return duplicate
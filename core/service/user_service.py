@@ -1,48 +1,109 @@
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, AsyncIterator
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update, delete, func
+from sqlalchemy import select, update, delete, func, bindparam, case, literal, any_, true
 from sqlalchemy.dialects.postgresql import insert
 import json
 from datetime import datetime
 
 from db.models import User, DeliveryLog
 
+_GET_USER_BY_TELEGRAM_ID_STMT = select(User).where(User.telegram_id == bindparam("telegram_id"))
+
+# user_id определяется на стороне БД: INSERT ... SELECT id FROM users
+_LOG_DELIVERY_STMT = insert(DeliveryLog).from_select(
+    [
+        "broadcast_task_id",
+        "user_id",
+        "telegram_id",
+        "message_type",
+        "status",
+        "error_message"
+    ],
+    select(
+        bindparam("broadcast_task_id", type_=DeliveryLog.broadcast_task_id.type),
+        User.id,
+        User.telegram_id,
+        bindparam("message_type", type_=DeliveryLog.message_type.type),
+        bindparam("status", type_=DeliveryLog.status.type),
+        bindparam("error_message", type_=DeliveryLog.error_message.type)
+    ).where(User.telegram_id == bindparam("telegram_id"))
+)
+
+
+def _delivery_log_row(telegram_id: int, message_type: str, status: str,
+                      error_message: Optional[str],
+                      broadcast_task_id: Optional[int]) -> Dict[str, Any]:
+    """Параметры _LOG_DELIVERY_STMT для одной записи"""
+    return {
+        "broadcast_task_id": broadcast_task_id,
+        "telegram_id": telegram_id,
+        "message_type": message_type,
+        "status": status,
+        "error_message": error_message
+    }
+
+
+def _audience_filter(required_channels: Optional[List[int]]):
+    """Условие подписки для выборки аудитории рассылки"""
+    if required_channels is None:
+        return User.is_subscribed == True
+    if not required_channels:
+        return true()
+    return User.subscriptions.contains(required_channels)
+
+
+
+def _history_with_theme(theme_id: int, limit: int):
+    """Выражение daily_theme_history после добавления темы
+    
+    Тема, уже присутствующая в истории, не добавляется повторно. Иначе
+    история обрезается до последних limit - 1 элементов и тема дописывается
+    в конец, так что в истории остается не больше limit тем.
+    """
+    history = User.daily_theme_history
+    length = func.cardinality(history)
+    # Сколько старых тем оставить, чтобы после добавления новой было limit
+    keep = limit - 1
+    # Массивы PostgreSQL индексируются с 1, границы среза включительные:
+    # последние keep элементов - это [length - keep + 1 : length]
+    first_kept = length - keep + 1
+    trimmed = case(
+        (length > keep, history[first_kept:length]),
+        else_=history
+    )
+    return case(
+        (literal(theme_id) == any_(history), history),
+        else_=func.array_append(trimmed, theme_id)
+    )
+
 
 class UserService:
     """Сервис для работы с пользователями"""
     
+    # Сколько последних тем хранится в daily_theme_history
+    THEME_HISTORY_LIMIT = 100
+    
+    # Размер пачки при потоковом чтении пользователей
+    STREAM_BATCH_SIZE = 1000
+    
     def __init__(self, db: AsyncSession):
         self.db = db
     
     async def get_or_create_user(self, telegram_id: int, username: str = None, 
                                 first_name: str = None, last_name: str = None) -> User:
         """Получить пользователя или создать нового"""
-        # Попытка найти существующего пользователя
-        result = await self.db.execute(
-            select(User).where(User.telegram_id == telegram_id)
-        )
-        user = result.scalar_one_or_none()
-        
-        if user:
-            # Обновить данные если изменились
-            if (user.username != username or 
-                user.first_name != first_name or 
-                user.last_name != last_name):
-                
-                await self.db.execute(
-                    update(User)
-                    .where(User.telegram_id == telegram_id)
-                    .values(
-                        username=username,
-                        first_name=first_name,
-                        last_name=last_name
-                    )
-                )
-                await self.db.commit()
+        # Обычный случай (пользователь есть, данные не менялись) - один SELECT
+        # без записи, блокировок и расхода последовательности users.id
+        user = await self.get_user_by_telegram_id(telegram_id)
+        if (user and
+                user.username == username and
+                user.first_name == first_name and
+                user.last_name == last_name):
             return user
         
-        # Создать нового пользователя
-        user = User(
+        # Новый пользователь или изменились данные: UPSERT ... RETURNING
+        # (ON CONFLICT покрывает гонку с параллельной регистрацией)
+        stmt = insert(User).values(
             telegram_id=telegram_id,
             username=username,
             first_name=first_name,
@@ -50,37 +111,75 @@ class UserService:
             subscriptions=[],
             daily_theme_history=[]
         )
-        self.db.add(user)
-        await self.db.commit()
-        await self.db.refresh(user)
-        return user
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['telegram_id'],
+            set_=dict(
+                username=stmt.excluded.username,
+                first_name=stmt.excluded.first_name,
+                last_name=stmt.excluded.last_name
+            )
+        )
+        result = await self.db.execute(
+            stmt.returning(User).execution_options(populate_existing=True)
+        )
+        return result.scalar_one()
     
-    async def update_user_subscriptions(self, telegram_id: int, 
-                                       subscriptions: List[int]) -> bool:
-        """Обновить список подписок пользователя"""
+    async def update_subscription(self, telegram_id: int,
+                                  subscriptions: Optional[List[int]] = None,
+                                  is_subscribed: Optional[bool] = None) -> bool:
+        """Обновить подписки и/или статус подписки пользователя одним UPDATE"""
+        values: Dict[str, Any] = {}
+        if subscriptions is not None:
+            values["subscriptions"] = subscriptions
+        if is_subscribed is not None:
+            values["is_subscribed"] = is_subscribed
+        if not values:
+            return False
+        
         result = await self.db.execute(
             update(User)
             .where(User.telegram_id == telegram_id)
-            .values(subscriptions=subscriptions)
+            .values(**values)
         )
-        await self.db.commit()
         return result.rowcount > 0
     
-    async def update_subscription_status(self, telegram_id: int, 
-                                        is_subscribed: bool) -> bool:
-        """Обновить статус подписки пользователя"""
+    async def check_subscription(self, telegram_id: int,
+                                 required_channels: List[int]) -> bool:
+        """Проверить, подписан ли пользователь на все обязательные каналы"""
         result = await self.db.execute(
-            update(User)
+            select(User.subscriptions.contains(required_channels))
             .where(User.telegram_id == telegram_id)
+        )
+        return bool(result.scalar_one_or_none())
+    
+    async def refresh_subscription_status(self, required_channels: List[int]) -> int:
+        """Пересчитать is_subscribed у всех пользователей (после смены каналов)"""
+        is_subscribed = func.coalesce(
+            User.subscriptions.contains(required_channels), False
+        )
+        # Переписываются только строки, у которых флаг действительно меняется
+        result = await self.db.execute(
+            update(User)
+            .where(User.is_subscribed.is_distinct_from(is_subscribed))
             .values(is_subscribed=is_subscribed)
+            .execution_options(synchronize_session=False)
         )
-        await self.db.commit()
-        return result.rowcount > 0
+        return result.rowcount
+    
+    async def update_user_subscriptions(self, telegram_id: int, 
+                                       subscriptions: List[int]) -> bool:
+        """Обновить список подписок пользователя"""
+        return await self.update_subscription(telegram_id, subscriptions=subscriptions)
+    
+    async def update_subscription_status(self, telegram_id: int, 
+                                        is_subscribed: bool) -> bool:
+        """Обновить статус подписки пользователя"""
+        return await self.update_subscription(telegram_id, is_subscribed=is_subscribed)
     
     async def get_user_by_telegram_id(self, telegram_id: int) -> Optional[User]:
         """Получить пользователя по Telegram ID"""
         result = await self.db.execute(
-            select(User).where(User.telegram_id == telegram_id)
+            _GET_USER_BY_TELEGRAM_ID_STMT, {"telegram_id": telegram_id}
         )
         return result.scalar_one_or_none()
     
@@ -117,29 +216,46 @@ class UserService:
         )
         return result.scalars().all()
     
-    async def add_theme_to_history(self, telegram_id: int, theme_id: int) -> bool:
-        """Добавить тему в историю пользователя"""
-        user = await self.get_user_by_telegram_id(telegram_id)
-        if not user:
-            return False
+    async def iter_subscribed_users(
+            self, required_channels: Optional[List[int]] = None
+    ) -> AsyncIterator[User]:
+        """Потоково перебрать подписанных пользователей для рассылки
         
-        history = user.daily_theme_history or []
-        if theme_id not in history:
-            history.append(theme_id)
-            # Ограничиваем историю последними 100 темами
-            if len(history) > 100:
-                history = history[-100:]
+        Строки читаются серверным курсором пачками по STREAM_BATCH_SIZE,
+        поэтому в памяти не держится вся таблица пользователей. Курсор живет
+        внутри транзакции сессии, так что записи во время перебора (логи,
+        история тем) нужно выполнять в отдельной сессии.
         
-        await self.db.execute(
+        Если передан required_channels, аудитория выбирается по
+        subscriptions @> required_channels (GIN индекс ix_users_subs)
+        вместо сохраненного флага is_subscribed. Пустой список означает,
+        что обязательных каналов нет и подписаны все активные пользователи.
+        """
+        result = await self.db.stream(
+            select(User)
+            .where(
+                _audience_filter(required_channels),
+                User.is_active == True
+            )
+            .execution_options(yield_per=self.STREAM_BATCH_SIZE)
+        )
+        async for user in result.scalars():
+            yield user
+    
+    async def add_theme_to_history(self, telegram_id: int, theme_id: int) -> bool:
+        """Добавить тему в историю пользователя"""
+        # Добавление и обрезка истории выполняются одним атомарным UPDATE
+        result = await self.db.execute(
             update(User)
             .where(User.telegram_id == telegram_id)
             .values(
-                daily_theme_history=history,
+                daily_theme_history=_history_with_theme(
+                    theme_id, self.THEME_HISTORY_LIMIT
+                ),
                 last_delivery_date=datetime.now()
             )
         )
-        await self.db.commit()
-        return True
+        return result.rowcount > 0
     
     async def deactivate_user(self, telegram_id: int) -> bool:
         """Деактивировать пользователя (заблокировал бота)"""
@@ -148,23 +264,71 @@ class UserService:
             .where(User.telegram_id == telegram_id)
             .values(is_active=False)
         )
-        await self.db.commit()
         return result.rowcount > 0
     
     async def log_delivery(self, telegram_id: int, message_type: str, 
                           status: str, error_message: str = None,
                           broadcast_task_id: int = None) -> None:
-        """Записать лог доставки сообщения"""
-        user = await self.get_user_by_telegram_id(telegram_id)
-        user_id = user.id if user else None
+        """Записать лог доставки сообщения
         
-        log = DeliveryLog(
-            broadcast_task_id=broadcast_task_id,
-            user_id=user_id,
-            telegram_id=telegram_id,
-            message_type=message_type,
-            status=status,
-            error_message=error_message
+        Для массовых рассылок используйте delivery_log_buffer().
+        """
+        await self.db.execute(
+            _LOG_DELIVERY_STMT,
+            _delivery_log_row(telegram_id, message_type, status,
+                              error_message, broadcast_task_id)
+        )
+    
+    def delivery_log_buffer(self, batch_size: int = None) -> "DeliveryLogBuffer":
+        """Буфер логов доставки для цикла рассылки"""
+        return DeliveryLogBuffer(self.db, batch_size or DeliveryLogBuffer.BATCH_SIZE)
+
+
+class DeliveryLogBuffer:
+    """Пакетная запись логов доставки
+    
+    Логи записываются пачками по batch_size одним executemany, остаток
+    сбрасывается при выходе из async with:
+    
+        async with user_service.delivery_log_buffer() as logs:
+            await logs.add(telegram_id, "broadcast", "sent")
+    """
+    
+    # Размер пачки по умолчанию
+    BATCH_SIZE = 500
+    
+    def __init__(self, db: AsyncSession, batch_size: int = BATCH_SIZE):
+        self.db = db
+        self.batch_size = batch_size
+        self._buffer: List[Dict[str, Any]] = []
+    
+    async def __aenter__(self) -> "DeliveryLogBuffer":
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        # При ошибке транзакция все равно будет откачена
+        if exc_type is None:
+            await self.flush()
+    
+    async def add(self, telegram_id: int, message_type: str,
+                  status: str, error_message: str = None,
+                  broadcast_task_id: int = None) -> None:
+        """Добавить лог в буфер (при заполнении пачки она записывается в БД)"""
+        self._buffer.append(
+            _delivery_log_row(telegram_id, message_type, status,
+                              error_message, broadcast_task_id)
         )
-        self.db.add(log)
-        await self.db.commit()
+        if len(self._buffer) >= self.batch_size:
+            await self.flush()
+    
+    async def flush(self) -> int:
+        """Записать накопленные логи доставки одним executemany"""
+        if not self._buffer:
+            return 0
+        
+        batch, self._buffer = self._buffer, []
+        
+        # executemany на уровне Core: asyncpg отправляет всю пачку конвейером
+        conn = await self.db.connection()
+        await conn.execute(_LOG_DELIVERY_STMT, batch)
+        return len(batch)
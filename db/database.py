@@ -1,28 +1,65 @@
+import orjson
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
 from core.config import settings
 from db.models import Base
+from db.session import AppSession
+
+def orjson_dumps(obj) -> str:
+    """Сериализация JSON/JSONB значений через orjson (SQLAlchemy ожидает str)"""
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+# В тестах пул не используется, чтобы соединения не делились между процессами
+if settings.testing:
+    pool_options = {"poolclass": NullPool}
+else:
+    pool_options = {
+        "poolclass": AsyncAdaptedQueuePool,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_recycle": settings.db_pool_recycle
+    }
 
 # Создание асинхронного движка базы данных
 engine = create_async_engine(
     settings.database_url,
     echo=settings.log_level == "DEBUG",
-    future=True
+    future=True,
+    # Кэш скомпилированных SQL выражений SQLAlchemy
+    query_cache_size=2048,
+    json_serializer=orjson_dumps,
+    json_deserializer=orjson.loads,
+    pool_pre_ping=True,
+    connect_args={
+        # Кэш подготовленных выражений asyncpg на каждое соединение
+        "prepared_statement_cache_size": settings.db_statement_cache_size,
+        # JIT только замедляет короткие OLTP-запросы
+        "server_settings": {"jit": "off"}
+    },
+    **pool_options
 )
 
 # Фабрика сессий
 AsyncSessionLocal = async_sessionmaker(
     engine,
     class_=AsyncSession,
+    sync_session_class=AppSession,
     expire_on_commit=False
 )
 
 
 async def get_db() -> AsyncSession:
-    """Dependency для получения сессии базы данных"""
+    """Dependency для получения сессии базы данных
+    
+    Весь запрос выполняется в одной транзакции: commit при успешном
+    завершении, rollback при исключении. Сервисы сами не коммитят.
+    """
     async with AsyncSessionLocal() as session:
         try:
-            yield session
+            async with session.begin():
+                yield session
         finally:
             await session.close()
 
@@ -0,0 +1,59 @@
+import asyncio
+
+from sqlalchemy import text
+
+from core.config import settings
+from core.service.config_service import ConfigService
+from db.database import AsyncSessionLocal, create_tables, engine
+
+
+async def init_config() -> None:
+    """Заполнить дефолтные настройки"""
+    async with AsyncSessionLocal() as session:
+        async with session.begin():
+            await ConfigService(session).init_default_config()
+
+
+async def preload_config() -> None:
+    """Прогреть кэш ConfigService текущего процесса"""
+    async with AsyncSessionLocal() as session:
+        await ConfigService(session).preload_cache()
+
+
+async def warm_up_pool() -> None:
+    """Заранее открыть соединения пула, чтобы первые запросы не ждали connect"""
+    if settings.testing:
+        return
+    
+    async def ping() -> None:
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+    
+    await asyncio.gather(*(ping() for _ in range(settings.db_pool_size)))
+
+
+async def init_db() -> None:
+    """Создание таблиц и дефолтных настроек (разовая инициализация)"""
+    await create_tables()
+    await init_config()
+
+
+async def on_startup() -> None:
+    """Прогрев при старте API/бота: вызывать в процессе, который обслуживает запросы
+    
+    Пул соединений и кэш настроек живут в памяти процесса, поэтому
+    прогревать их в отдельном скрипте бессмысленно.
+    """
+    await asyncio.gather(warm_up_pool(), preload_config())
+
+
+async def main() -> None:
+    try:
+        await init_db()
+    finally:
+        # Закрыть соединения пула до остановки event loop
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,5 +1,8 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, JSON
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, DateTime, Text, JSON, Index, Computed
+from sqlalchemy import text as sa_text
+from sqlalchemy.dialects.postgresql import ARRAY, TSVECTOR
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import deferred
 from sqlalchemy.sql import func
 from datetime import datetime
 from typing import Optional, List, Dict, Any
@@ -11,16 +14,23 @@ class User(Base):
     __tablename__ = "users"
     
     id = Column(Integer, primary_key=True, index=True)
-    telegram_id = Column(Integer, unique=True, index=True, nullable=False)
+    telegram_id = Column(BigInteger, unique=True, index=True, nullable=False)
     username = Column(String(255), nullable=True)
     first_name = Column(String(255), nullable=True)
     last_name = Column(String(255), nullable=True)
     is_active = Column(Boolean, default=True)
     is_subscribed = Column(Boolean, default=False)  # подписан на все обязательные каналы
-    subscriptions = Column(JSON, default=list)  # список ID каналов на которые подписан
+    subscriptions = Column(ARRAY(BigInteger), default=list)  # список ID каналов на которые подписан
     registration_date = Column(DateTime, default=func.now())
     last_delivery_date = Column(DateTime, nullable=True)
-    daily_theme_history = Column(JSON, default=list)  # история отправленных тем
+    daily_theme_history = Column(ARRAY(Integer), default=list)  # история отправленных тем
+    
+    __table_args__ = (
+        # Выборка аудитории рассылки
+        Index("ix_users_subscribed_active", "is_subscribed", "is_active"),
+        # Проверка подписок через containment (subscriptions @> required)
+        Index("ix_users_subs", "subscriptions", postgresql_using="gin"),
+    )
     
     def __repr__(self):
         return f"<User(telegram_id={self.telegram_id}, username={self.username})>"
@@ -38,6 +48,31 @@ class Theme(Base):
     is_sent = Column(Boolean, default=False)
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    # Полнотекстовый индекс по заголовку и тексту (вычисляется PostgreSQL).
+    # Нужен только в WHERE, поэтому не загружается вместе с темой
+    search_vector = deferred(Column(
+        TSVECTOR,
+        Computed(
+            "to_tsvector('russian', coalesce(title, '') || ' ' || coalesce(text, ''))",
+            persisted=True
+        )
+    ))
+    
+    __table_args__ = (
+        Index("ix_themes_fts", "search_vector", postgresql_using="gin"),
+        # Очередь тем: неотправленные без даты в порядке создания
+        Index(
+            "ix_themes_queue_created",
+            "created_at",
+            postgresql_where=sa_text("schedule_date IS NULL AND is_sent = false")
+        ),
+        # Запланированные и просроченные неотправленные темы
+        Index(
+            "ix_themes_sched_pending",
+            "schedule_date",
+            postgresql_where=sa_text("is_sent = false")
+        ),
+    )
     
     def __repr__(self):
         return f"<Theme(id={self.id}, title={self.title})>"
@@ -86,12 +121,23 @@ class DeliveryLog(Base):
     id = Column(Integer, primary_key=True, index=True)
     broadcast_task_id = Column(Integer, nullable=True)  # null для ежедневных рассылок
     user_id = Column(Integer, nullable=False)
-    telegram_id = Column(Integer, nullable=False)
+    telegram_id = Column(BigInteger, nullable=False)
     message_type = Column(String(50), nullable=False)  # daily_theme/broadcast/subscription_check
     status = Column(String(50), nullable=False)  # sent/delivered/failed/blocked
     error_message = Column(Text, nullable=True)
     sent_at = Column(DateTime, default=func.now())
     
+    __table_args__ = (
+        Index("ix_dlog_task", "broadcast_task_id"),
+        Index("ix_dlog_user_sent", "telegram_id", "sent_at"),
+        # Отчеты по ошибкам доставки
+        Index(
+            "ix_dlog_failed",
+            "sent_at",
+            postgresql_where=sa_text("status = 'failed'")
+        ),
+    )
+    
     def __repr__(self):
         return f"<DeliveryLog(telegram_id={self.telegram_id}, status={self.status})>"
 
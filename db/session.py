@@ -0,0 +1,9 @@
+from sqlalchemy.orm import Session
+
+
+class AppSession(Session):
+    """Синхронная сессия приложения (sync_session_class для AsyncSessionLocal)
+    
+    Отдельный класс, чтобы события ORM сервисов (after_commit и т.п.)
+    подписывались только на сессии приложения, а не на все Session процесса.
+    """
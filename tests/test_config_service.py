@@ -0,0 +1,61 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from core.service.config_service import ConfigService, _PENDING_INVALIDATION
+from db.session import AppSession
+
+
+@pytest.mark.parametrize("value", [None, "", "garbage", "[1,", '{"a": 1}', "5"])
+def test_parse_channels_invalid_value_returns_empty_list(value):
+    assert ConfigService._parse_channels(value) == []
+
+
+def test_parse_channels_converts_numeric_strings():
+    assert ConfigService._parse_channels('[-100123, "-100456", "42"]') == [-100123, -100456, 42]
+
+
+def test_parse_channels_skips_invalid_elements():
+    value = '["--5", "@example_channel", "²", " 42", null, true, 1.5, {"id": 1}, -7]'
+    assert ConfigService._parse_channels(value) == [-7]
+
+
+@pytest.fixture
+def cache():
+    ConfigService._cache.clear()
+    ConfigService._cache.update({
+        "rate_limit": (0.0, "30"),
+        "required_channels:parsed": (0.0, [1]),
+        "timezone": (0.0, "Europe/Moscow"),
+    })
+    yield ConfigService._cache
+    ConfigService._cache.clear()
+
+
+def commit_with_pending(session: Session, keys, rollback: bool = False) -> None:
+    session.execute(text("SELECT 1"))
+    session.info[_PENDING_INVALIDATION] = set(keys)
+    if rollback:
+        session.rollback()
+    else:
+        session.commit()
+
+
+def test_cache_invalidated_after_app_session_commit(cache):
+    with AppSession(create_engine("sqlite://")) as session:
+        commit_with_pending(session, {"required_channels"})
+    assert set(cache) == {"rate_limit", "timezone"}
+
+
+def test_cache_kept_after_app_session_rollback(cache):
+    with AppSession(create_engine("sqlite://")) as session:
+        commit_with_pending(session, {"rate_limit"}, rollback=True)
+        assert _PENDING_INVALIDATION not in session.info
+    assert "rate_limit" in cache
+
+
+def test_other_sessions_are_not_hooked(cache):
+    with Session(create_engine("sqlite://")) as session:
+        commit_with_pending(session, {"rate_limit"})
+        assert _PENDING_INVALIDATION in session.info
+    assert "rate_limit" in cache
@@ -0,0 +1,18 @@
+from sqlalchemy.dialects import postgresql
+
+from core.service.theme_service import _GET_THEME_BY_ID_STMT, _THEME_RETURNING_COLUMNS
+
+
+def compile_pg(stmt) -> str:
+    return str(stmt.compile(dialect=postgresql.asyncpg.dialect()))
+
+
+def test_theme_load_skips_search_vector():
+    """search_vector нужен только в WHERE и не загружается вместе с темой"""
+    assert "search_vector" not in compile_pg(_GET_THEME_BY_ID_STMT)
+
+
+def test_theme_returning_skips_search_vector():
+    keys = {column.key for column in _THEME_RETURNING_COLUMNS}
+    assert "search_vector" not in keys
+    assert {"id", "title", "text", "created_at"} <= keys
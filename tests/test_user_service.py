@@ -0,0 +1,41 @@
+from sqlalchemy.dialects import postgresql
+
+from core.service.user_service import _audience_filter, _history_with_theme
+
+
+def compile_pg(clause) -> str:
+    return str(clause.compile(dialect=postgresql.asyncpg.dialect()))
+
+
+def test_audience_without_channels_uses_stored_flag():
+    assert compile_pg(_audience_filter(None)) == "users.is_subscribed = true"
+
+
+def test_audience_with_empty_channels_is_everyone():
+    assert compile_pg(_audience_filter([])) == "true"
+
+
+def test_audience_with_channels_uses_containment():
+    assert "users.subscriptions @>" in compile_pg(_audience_filter([-100123]))
+
+
+def test_history_keeps_last_99_then_appends():
+    """При длине истории >= 100 остаются последние 99 тем, затем дописывается новая"""
+    sql = str(_history_with_theme(7, 100).compile(
+        dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+    ))
+    history = "users.daily_theme_history"
+    length = f"cardinality({history})"
+
+    assert f"WHEN (7 = ANY ({history})) THEN {history}" in sql
+    assert f"WHEN ({length} > 99)" in sql
+    assert f"{history}[({length} - 99) + 1:{length}]" in sql
+    assert sql.endswith(", 7) END")
+
+    # Срез PostgreSQL [a:b] - 1-based и включительный
+    for n in (99, 100, 150):
+        themes = list(range(1, n + 1))
+        first_kept = n - 99 + 1
+        trimmed = themes[first_kept - 1:n] if n > 99 else themes
+        assert trimmed == themes[-99:]
+        assert len(trimmed + [0]) == 100